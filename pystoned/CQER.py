@@ -2,7 +2,6 @@
 from pyomo.environ import ConcreteModel, Set, Var, Objective, minimize, Constraint, log
 from pyomo.core.expr.numvalue import NumericValue
 import numpy as np
-import pandas as pd
 
 from .constant import CET_ADDI, CET_MULT, FUN_PROD, FUN_COST, RTS_CRS, RTS_VRS, OPT_LOCAL, OPT_DEFAULT
 from .utils import tools, interpolation
@@ -287,11 +286,10 @@ class CQR:
     def get_beta(self):
         """Return beta value by array"""
         tools.assert_optimized(self.optimization_status)
-        beta = np.asarray([i + tuple([j]) for i, j in zip(list(self.__model__.beta),
-                                                          list(self.__model__.beta[:, :].value))])
-        beta = pd.DataFrame(beta, columns=['Name', 'Key', 'Value'])
-        beta = beta.pivot(index='Name', columns='Key', values='Value')
-        return beta.to_numpy()
+        beta = np.empty((len(self.__model__.I), len(self.__model__.J)), dtype=np.float64)
+        for (i, j), v in self.__model__.beta.items():
+            beta[i, j] = v.value
+        return beta
 
     def get_lamda(self):
         """Return beta value by array"""
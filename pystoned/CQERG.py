@@ -52,9 +52,14 @@ class CQRG:
 
         self.count = 0
         while self.__convergence_test(self.alpha, self.beta) > 0.0001:
-            if type(self.z) != type(None):
+            if type(self.z) != type(None) and self.count > 0 and tools.is_persistent_solver(solver):
+                # keep the persistent solver and only add the newly violated constraints
+                model2.add_cutactive(self.active)
+            elif type(self.z) != type(None):
                 model2 = CQERZG2.CQRZG2(
                     self.y, self.x, self.z, self.tau, self.active, self.cutactive, self.cet, self.fun, self.rts)
+                # start from the previous iterate, which is close to the new solution
+                model2.warm_start(self.alpha, self.beta, list(self.__model__.lamda[:].value))
             else:
                 model2 = CQERG2.CQRG2(
                     self.y, self.x, self.tau, self.active, self.cutactive, self.cet, self.fun, self.rts)
@@ -285,9 +290,14 @@ class CERG:
 
         self.count = 0
         while self.__convergence_test(self.alpha, self.beta) > 0.0001:
-            if type(self.z) != type(None):
+            if type(self.z) != type(None) and self.count > 0 and tools.is_persistent_solver(solver):
+                # keep the persistent solver and only add the newly violated constraints
+                model2.add_cutactive(self.active)
+            elif type(self.z) != type(None):
                 model2 = CQERZG2.CERZG2(
                     self.y, self.x, self.z, self.tau, self.active, self.cutactive, self.cet, self.fun, self.rts)
+                # start from the previous iterate, which is close to the new solution
+                model2.warm_start(self.alpha, self.beta, list(self.__model__.lamda[:].value))
             else:
                 model2 = CQERG2.CERG2(
                     self.y, self.x, self.tau, self.active, self.cutactive, self.cet, self.fun, self.rts)
@@ -1,7 +1,34 @@
 # import dependencies
-from pyomo.environ import Objective, minimize, Constraint
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from os import cpu_count
+from pyomo.environ import Constraint, quicksum, sum_product
+from pyomo.core.expr.numeric_expr import LinearExpression
 from . import CQER
-from .constant import CET_ADDI, FUN_PROD, RTS_VRS
+from .constant import CET_ADDI, FUN_PROD, RTS_VRS, OPT_LOCAL, OPT_DEFAULT
+from .utils import tools
+
+
+def _fit_one(args):
+    """Estimate one (tau, eta) point of the grid and return its alpha, beta and residual"""
+    model_class, y, x, tau, eta, z, cet, fun, rts, penalty, solver = args
+    model = model_class(y, x, tau, eta, z, cet, fun, rts, penalty)
+    # one solver thread per worker, the grid points run in parallel
+    model.problem_status, model.optimization_status = tools.optimize_model(
+        model.__model__, OPT_LOCAL, cet, solver, options=tools.single_thread_options(solver))
+    alpha = model.get_alpha() if rts == RTS_VRS else None
+    return alpha, model.get_beta(), model.get_residual()
+
+
+def _grid_fit(model_class, y, x, taus, etas, z, cet, fun, rts, penalty, solver, max_workers):
+    """Estimate the penalized model on the grid of taus and etas in parallel processes"""
+    grid = list(product(taus, etas))
+    if max_workers is None:
+        max_workers = max(1, (cpu_count() or 2) // 2)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(_fit_one, [(model_class, y, x, tau, eta, z, cet, fun, rts, penalty, solver)
+                                          for tau, eta in grid])
+        return dict(zip(grid, results))
 
 
 class pCQR(CQER.CQR):
@@ -24,17 +51,13 @@ class pCQR(CQER.CQR):
         """
         self.eta = eta
         CQER.CQR.__init__(self, y, x, tau, z, cet, fun, rts)
-        if penalty == 1 or penalty == 2:
-            self.__model__.objective.deactivate()
+        self.__beta_vars = [self.__model__.beta[i, j] for i in self.__model__.I for j in self.__model__.J]
 
+        # add the penalty term to the CQR objective
         if penalty == 1:
-            self.__model__.new_objective = Objective(rule=self.__new_objective_rule(),
-                                                     sense=minimize,
-                                                     doc='objective function')
+            self.__model__.objective.expr = self.__model__.objective.expr + self.__l1_penalty()
         elif penalty == 2:
-            self.__model__.new_objective = Objective(rule=self.__new_objective_rule2(),
-                                                     sense=minimize,
-                                                     doc='objective function')
+            self.__model__.objective.expr = self.__model__.objective.expr + self.__l2_penalty()
         elif penalty == 3:
             self.__model__.lipschitz_norm = Constraint(self.__model__.I,
                                                        rule=self.__lipschitz_rule(),
@@ -42,32 +65,47 @@ class pCQR(CQER.CQR):
         else:
             raise ValueError('Penalty must be 1, 2, or 3.')
 
-    def __new_objective_rule(self):
-        """Return the proper objective function"""
+    @classmethod
+    def grid_fit(cls, y, x, taus, etas, z=None, cet=CET_ADDI, fun=FUN_PROD, rts=RTS_VRS, penalty=1,
+                 solver=OPT_DEFAULT, max_workers=None):
+        """Estimate the pCQR model on a grid of quantiles and tuning parameters in parallel
 
-        def objective_rule(model):
-            return self.tau * sum(model.epsilon_plus[i] for i in model.I) \
-                + (1 - self.tau) * sum(model.epsilon_minus[i] for i in model.I) \
-                + self.eta * sum(model.beta[ij] for ij in model.I * model.J)
+        Each (tau, eta) point is optimized locally in its own process with a single solver thread.
 
-        return objective_rule
+        Args:
+            y (float): output variable.
+            x (float): input variables.
+            taus (float): quantiles.
+            etas (float): tuning parameters.
+            z (float, optional): Contextual variable(s). Defaults to None.
+            cet (String, optional): CET_ADDI (additive composite error term) or CET_MULT (multiplicative composite error term). Defaults to CET_ADDI.
+            fun (String, optional): FUN_PROD (production frontier) or FUN_COST (cost frontier). Defaults to FUN_PROD.
+            rts (String, optional): RTS_VRS (variable returns to scale) or RTS_CRS (constant returns to scale). Defaults to RTS_VRS.
+            penalty (int, optional): penalty=1 (L1 norm), penalty=2 (L2 norm), and penalty=3 (Lipschitz norm). Defaults to 1.
+            solver (string, optional): The solver chosen for optimization. It will optimize with default solver if OPT_DEFAULT is given.
+            max_workers (int, optional): number of worker processes. Defaults to half of the CPU count.
 
-    def __new_objective_rule2(self):
-        """Return the proper objective function"""
+        Returns:
+            dict: (alpha, beta, residual) arrays by (tau, eta); alpha is None under RTS_CRS.
+        """
+        return _grid_fit(cls, y, x, taus, etas, z, cet, fun, rts, penalty, solver, max_workers)
 
-        def objective_rule(model):
-            return self.tau * sum(model.epsilon_plus[i] for i in model.I) \
-                + (1 - self.tau) * sum(model.epsilon_minus[i] for i in model.I) \
-                + self.eta * sum(model.beta[ij] **
-                                 2 for ij in model.I * model.J)
+    def __l1_penalty(self):
+        """Return the L1 norm penalty"""
+        return LinearExpression(linear_coefs=[self.eta] * len(self.__beta_vars),
+                                linear_vars=self.__beta_vars)
 
-        return objective_rule
+    def __l2_penalty(self):
+        """Return the L2 norm penalty"""
+        return self.eta * quicksum(beta * beta for beta in self.__beta_vars)
 
     def __lipschitz_rule(self):
         """Lipschitz norm"""
+        beta_rows = [[self.__model__.beta[i, j] for j in self.__model__.J] for i in self.__model__.I]
+        index = range(len(self.__model__.J))
 
         def lipschitz_rule(model, i):
-            return sum(model.beta[i, j] ** 2 for j in model.J) <= self.eta**2
+            return sum_product(beta_rows[i], beta_rows[i], index=index) <= self.eta**2
 
         return lipschitz_rule
 
@@ -92,17 +130,15 @@ class pCER(CQER.CER):
         """
         self.eta = eta
         CQER.CER.__init__(self, y, x, tau, z, cet, fun, rts)
-        if penalty == 1 or penalty == 2:
-            self.__model__.squared_objective.deactivate()
+        self.__beta_vars = [self.__model__.beta[i, j] for i in self.__model__.I for j in self.__model__.J]
 
+        # add the penalty term to the CER objective
         if penalty == 1:
-            self.__model__.new_objective = Objective(rule=self.__new_squared_objective_rule(),
-                                                     sense=minimize,
-                                                     doc='objective function')
+            self.__model__.squared_objective.expr = \
+                self.__model__.squared_objective.expr + self.__l1_penalty()
         elif penalty == 2:
-            self.__model__.new_objective = Objective(rule=self.__new_squared_objective_rule2(),
-                                                     sense=minimize,
-                                                     doc='objective function')
+            self.__model__.squared_objective.expr = \
+                self.__model__.squared_objective.expr + self.__l2_penalty()
         elif penalty == 3:
             self.__model__.lipschitz_norm = Constraint(self.__model__.I,
                                                        rule=self.__lipschitz_rule(),
@@ -110,31 +146,46 @@ class pCER(CQER.CER):
         else:
             raise ValueError('Penalty must be 1, 2, or 3.')
 
-    def __new_squared_objective_rule(self):
-        """Return the proper objective function"""
+    @classmethod
+    def grid_fit(cls, y, x, taus, etas, z=None, cet=CET_ADDI, fun=FUN_PROD, rts=RTS_VRS, penalty=1,
+                 solver=OPT_DEFAULT, max_workers=None):
+        """Estimate the pCER model on a grid of expectiles and tuning parameters in parallel
 
-        def objective_rule(model):
-            return self.tau * sum(model.epsilon_plus[i] ** 2 for i in model.I) \
-                + (1 - self.tau) * sum(model.epsilon_minus[i] ** 2 for i in model.I) \
-                + self.eta * sum(model.beta[ij] for ij in model.I * model.J)
+        Each (tau, eta) point is optimized locally in its own process with a single solver thread.
 
-        return objective_rule
+        Args:
+            y (float): output variable.
+            x (float): input variables.
+            taus (float): expectiles.
+            etas (float): tuning parameters.
+            z (float, optional): Contextual variable(s). Defaults to None.
+            cet (String, optional): CET_ADDI (additive composite error term) or CET_MULT (multiplicative composite error term). Defaults to CET_ADDI.
+            fun (String, optional): FUN_PROD (production frontier) or FUN_COST (cost frontier). Defaults to FUN_PROD.
+            rts (String, optional): RTS_VRS (variable returns to scale) or RTS_CRS (constant returns to scale). Defaults to RTS_VRS.
+            penalty (int, optional): penalty=1 (L1 norm), penalty=2 (L2 norm), and penalty=3 (Lipschitz norm). Defaults to 1.
+            solver (string, optional): The solver chosen for optimization. It will optimize with default solver if OPT_DEFAULT is given.
+            max_workers (int, optional): number of worker processes. Defaults to half of the CPU count.
 
-    def __new_squared_objective_rule2(self):
-        """Return the proper objective function"""
+        Returns:
+            dict: (alpha, beta, residual) arrays by (tau, eta); alpha is None under RTS_CRS.
+        """
+        return _grid_fit(cls, y, x, taus, etas, z, cet, fun, rts, penalty, solver, max_workers)
 
-        def objective_rule(model):
-            return self.tau * sum(model.epsilon_plus[i] ** 2 for i in model.I) \
-                + (1 - self.tau) * sum(model.epsilon_minus[i] ** 2 for i in model.I) \
-                + self.eta * sum(model.beta[ij] **
-                                 2 for ij in model.I * model.J)
+    def __l1_penalty(self):
+        """Return the L1 norm penalty"""
+        return LinearExpression(linear_coefs=[self.eta] * len(self.__beta_vars),
+                                linear_vars=self.__beta_vars)
 
-        return objective_rule
+    def __l2_penalty(self):
+        """Return the L2 norm penalty"""
+        return self.eta * quicksum(beta * beta for beta in self.__beta_vars)
 
     def __lipschitz_rule(self):
         """Lipschitz norm"""
+        beta_rows = [[self.__model__.beta[i, j] for j in self.__model__.J] for i in self.__model__.I]
+        index = range(len(self.__model__.J))
 
         def lipschitz_rule(model, i):
-            return sum(model.beta[i, j] ** 2 for j in model.J) <= self.eta**2
+            return sum_product(beta_rows[i], beta_rows[i], index=index) <= self.eta**2
 
         return lipschitz_rule
\ No newline at end of file
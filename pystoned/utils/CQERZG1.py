@@ -2,7 +2,6 @@
 from pyomo.environ import ConcreteModel, Set, Var, Objective, minimize, Constraint, log
 from pyomo.core.expr.numvalue import NumericValue
 import numpy as np
-import pandas as pd
 from ..constant import CET_ADDI, CET_MULT, FUN_PROD, FUN_COST, RTS_CRS, RTS_VRS, OPT_DEFAULT, OPT_LOCAL
 from .tools import optimize_model
 
@@ -280,11 +279,10 @@ class CQRZG1:
         """Return beta value by array"""
         if self.optimization_status == 0:
             self.optimize()
-        beta = np.asarray([i + tuple([j]) for i, j in zip(list(self.__model__.beta),
-                                                          list(self.__model__.beta[:, :].value))])
-        beta = pd.DataFrame(beta, columns=['Name', 'Key', 'Value'])
-        beta = beta.pivot(index='Name', columns='Key', values='Value')
-        return beta.to_numpy()
+        beta = np.empty((len(self.__model__.I), len(self.__model__.J)), dtype=np.float64)
+        for (i, j), v in self.__model__.beta.items():
+            beta[i, j] = v.value
+        return beta
 
 
 class CERZG1(CQRZG1):
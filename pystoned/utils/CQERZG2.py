@@ -1,10 +1,33 @@
 # import dependencies
-from pyomo.environ import ConcreteModel, Set, Var, Objective, minimize, Constraint, log
+from pyomo.environ import ConcreteModel, Set, Var, Objective, minimize, Constraint, ConstraintList, log, quicksum
 from pyomo.core.expr.numvalue import NumericValue
+from pyomo.core.expr.numeric_expr import LinearExpression
 import numpy as np
-import pandas as pd
+from scipy.sparse import coo_matrix
 from ..constant import CET_ADDI, CET_MULT, FUN_PROD, FUN_COST, RTS_CRS, RTS_VRS, OPT_DEFAULT, OPT_LOCAL
-from .tools import optimize_model, trans_list, to_2d_list
+from .tools import optimize_model, optimize_persistent_model, is_persistent_solver, trans_list, to_2d_list
+
+
+def _pair_coefs(row_index, row_coefs, pair_i, pair_h):
+    """Return the COO triplets of f_i(x_i) - f_h(x_i) for each pair (i, h)
+
+    Args:
+        row_index (ndarray): (n, w) variable columns of the production expression of each observation.
+        row_coefs (ndarray): (n, w) coefficients of the production expression of each observation.
+        pair_i (ndarray): first index of each pair.
+        pair_h (ndarray): second index of each pair.
+
+    Returns:
+        tuple: row, column and value arrays with one row per pair.
+    """
+    w = row_index.shape[1]
+    rows = np.repeat(np.arange(len(pair_i)), 2 * w)
+    cols = np.empty((len(pair_i), 2 * w), dtype=int)
+    data = np.empty((len(pair_i), 2 * w), dtype=np.float64)
+    cols[:, :w], cols[:, w:] = row_index[pair_i], row_index[pair_h]
+    data[:, :w] = row_coefs[pair_i]
+    data[:, w:] = -data[:, :w]
+    return rows, cols.ravel(), data.ravel()
 
 
 class CQRZG2:
@@ -26,7 +49,10 @@ class CQRZG2:
             rts (String, optional): RTS_VRS (variable returns to scale) or RTS_CRS (constant returns to scale). Defaults to RTS_VRS.
         """
         # TODO(error/warning handling): Check the configuration of the model exist
-        self.x, self.y, self.z, self.tau, self.cet, self.fun, self.rts = x, y, z, tau, cet, fun, rts
+        self.y, self.tau, self.cet, self.fun, self.rts = y, tau, cet, fun, rts
+        # store x and z as contiguous (n, d) and (n, k) arrays
+        self.x = np.ascontiguousarray(x, dtype=np.float64).reshape(len(y), -1)
+        self.z = np.ascontiguousarray(z, dtype=np.float64).reshape(len(y), -1)
         self.cutactive = cutactive
         self.active = to_2d_list(trans_list(active))
 
@@ -35,8 +61,10 @@ class CQRZG2:
 
         # Initialize the sets
         self.__model__.I = Set(initialize=range(len(self.y)))
-        self.__model__.J = Set(initialize=range(len(self.x[0])))
-        self.__model__.K = Set(initialize=range(len(self.z[0])))
+        self.__model__.J = Set(initialize=range(self.x.shape[1]))
+        self.__model__.K = Set(initialize=range(self.z.shape[1]))
+        # successor of each observation in the elementary Afriat approach (I.nextw)
+        self.__next = np.roll(np.arange(len(self.y)), -1)
 
         # Initialize the variables
         self.__model__.alpha = Var(self.__model__.I, doc='alpha')
@@ -61,27 +89,55 @@ class CQRZG2:
         self.__model__.error_decomposition = Constraint(self.__model__.I,
                                                         rule=self.__error_decomposition(),
                                                         doc='decompose error term')
-        self.__model__.regression_rule = Constraint(self.__model__.I,
-                                                    rule=self.__regression_rule(),
-                                                    doc='regression equation')
-        if self.cet == CET_MULT:
+
+        # Build the linear constraints from sparse coefficient matrices
+        self.__beta = [[self.__model__.beta[i, j] for j in self.__model__.J] for i in self.__model__.I]
+        self.__variables = [self.__model__.alpha[i] for i in self.__model__.I] + \
+            [beta for row in self.__beta for beta in row] + \
+            [self.__model__.lamda[k] for k in self.__model__.K] + \
+            [self.__model__.epsilon[i] for i in self.__model__.I]
+        # production expression alpha[i] + sum_j beta[i, j] * x[i, j] of each observation,
+        # cached as variable columns and coefficients with alpha in the first position
+        n, d = self.x.shape
+        self.__row_index = np.column_stack((np.arange(n), n + np.arange(n * d).reshape(n, d)))
+        self.__row_coefs = np.column_stack((np.ones(n), self.x))
+        # Active (i, h) pairs of the sweet spot constraints
+        self.__model__.SweetIdx = Set(initialize=self.__active_pairs(self.cutactive), dimen=2)
+        self.__model__.SweetIdx2 = Set(initialize=self.__active_pairs(self.active), dimen=2)
+        blocks = self.__build_sparse_blocks()
+
+        if self.cet == CET_ADDI:
+            self.__model__.regression_rule = ConstraintList(doc='regression equation')
+            for expr in self.__sparse_rows(blocks['regression'], NumericValue.__eq__):
+                self.__model__.regression_rule.add(expr)
+        elif self.cet == CET_MULT:
+            self.__model__.regression_rule = Constraint(self.__model__.I,
+                                                        rule=self.__regression_rule(),
+                                                        doc='regression equation')
             self.__model__.log_rule = Constraint(self.__model__.I,
                                                  rule=self.__log_rule(),
                                                  doc='log-transformed regression equation')
-        self.__model__.afriat_rule = Constraint(self.__model__.I,
-                                                rule=self.__afriat_rule(),
-                                                doc='elementary Afriat approach')
-        self.__model__.sweet_rule = Constraint(self.__model__.I,
-                                               self.__model__.I,
-                                               rule=self.__sweet_rule(),
-                                               doc='sweet spot approach')
-        self.__model__.sweet_rule2 = Constraint(self.__model__.I,
-                                                self.__model__.I,
-                                                rule=self.__sweet_rule2(),
-                                                doc='sweet spot-2 approach')
+
+        if self.fun == FUN_PROD:
+            self.__operator = NumericValue.__le__
+        elif self.fun == FUN_COST:
+            self.__operator = NumericValue.__ge__
+
+        self.__model__.afriat_rule = ConstraintList(doc='elementary Afriat approach')
+        for expr in self.__sparse_rows(blocks['afriat'], self.__operator):
+            self.__model__.afriat_rule.add(expr)
+        # the k-th sweet spot constraint belongs to the k-th pair of SweetIdx (SweetIdx2)
+        self.__model__.sweet_rule = ConstraintList(doc='sweet spot approach')
+        for expr in self.__sparse_rows(blocks['sweet'], self.__operator):
+            self.__model__.sweet_rule.add(expr)
+        self.__model__.sweet_rule2 = ConstraintList(doc='sweet spot-2 approach')
+        for expr in self.__sparse_rows(blocks['sweet2'], self.__operator):
+            self.__model__.sweet_rule2.add(expr)
 
         # Optimize model
         self.optimization_status, self.problem_status = 0, 0
+        self.__warmstart = False
+        self.__solver = None
 
     def optimize(self, email=OPT_LOCAL, solver=OPT_DEFAULT):
         """Optimize the function by requested method
@@ -91,15 +147,54 @@ class CQRZG2:
             solver (string): The solver chosen for optimization. It will optimize with default solver if OPT_DEFAULT is given.
         """
         # TODO(error/warning handling): Check problem status after optimization
+        if email == OPT_LOCAL and is_persistent_solver(solver):
+            # the persistent solver instance is built once and kept for later solves
+            self.__solver, self.problem_status, self.optimization_status = optimize_persistent_model(
+                self.__model__, self.cet, solver, self.__solver, self.__warmstart)
+            return
         self.problem_status, self.optimization_status = optimize_model(
-            self.__model__, email, self.cet, solver)
+            self.__model__, email, self.cet, solver, self.__warmstart)
+
+    def add_cutactive(self, cutactive):
+        """Add the sweet spot constraints of the newly active pairs
+
+        Args:
+            cutactive (float): active concavity constraint.
+        """
+        pairs = [pair for pair in self.__active_pairs(cutactive)
+                 if pair not in self.__model__.SweetIdx]
+        for pair, expr in zip(pairs, self.__sparse_rows(self.__pair_block(pairs), self.__operator)):
+            self.__model__.SweetIdx.add(pair)
+            constraint = self.__model__.sweet_rule.add(expr)
+            if self.__solver is not None:
+                self.__solver.add_constraint(constraint)
+        self.cutactive = cutactive
+        self.optimization_status = 0
+
+    def warm_start(self, alpha0, beta0, lamda0):
+        """Initialize the variables with the solution of a previous iteration
+
+        Args:
+            alpha0 (float): previous alpha values.
+            beta0 (float): previous beta values.
+            lamda0 (float): previous lamda values.
+        """
+        for i in self.__model__.I:
+            self.__model__.alpha[i].value = alpha0[i]
+            for j in self.__model__.J:
+                self.__beta[i][j].value = beta0[i][j]
+        for k in self.__model__.K:
+            self.__model__.lamda[k].value = lamda0[k]
+        self.__warmstart = True
 
     def __objective_rule(self):
         """Return the proper objective function"""
 
         def objective_rule(model):
-            return self.tau * sum(model.epsilon_plus[i] for i in model.I) \
-                + (1 - self.tau) * sum(model.epsilon_minus[i] for i in model.I)
+            return LinearExpression(
+                linear_coefs=[self.tau] * len(model.I) + [1 - self.tau] * len(model.I),
+                linear_vars=[model.epsilon_plus[i] for i in model.I] +
+                [model.epsilon_minus[i] for i in model.I])
 
         return objective_rule
 
@@ -112,30 +207,15 @@ class CQRZG2:
         return error_decompose_rule
 
     def __regression_rule(self):
-        """Return the proper regression constraint"""
-        if self.cet == CET_ADDI:
-            if self.rts == RTS_VRS:
-
-                def regression_rule(model, i):
-                    return self.y[i] == model.alpha[i] + \
-                        sum(model.beta[i, j] * self.x[i][j] for j in model.J) + \
-                        sum(model.lamda[k] * self.z[i][k]
-                            for k in model.K) + model.epsilon[i]
-
-                return regression_rule
-            elif self.rts == RTS_CRS:
-                def regression_rule(model, i):
-                    return self.y[i] == sum(model.beta[i, j] * self.x[i][j] for j in model.J) + \
-                        sum(model.lamda[k] * self.z[i][k]
-                            for k in model.K) + model.epsilon[i]
-
-                return regression_rule
-
-        elif self.cet == CET_MULT:
+        """Return the proper log-transformed regression constraint"""
+        if self.cet == CET_MULT:
+            y, z = self.y, self.z.tolist()
+            lamda = [self.__model__.lamda[k] for k in self.__model__.K]
 
             def regression_rule(model, i):
-                return log(self.y[i]) == log(model.frontier[i] + 1) + sum(model.lamda[k] * self.z[i][k] for k in model.K) + \
-                    model.epsilon[i]
+                return log(y[i]) == log(model.frontier[i] + 1) + LinearExpression(
+                    linear_coefs=z[i] + [1.0],
+                    linear_vars=lamda + [model.epsilon[i]])
 
             return regression_rule
 
@@ -143,196 +223,95 @@ class CQRZG2:
 
     def __log_rule(self):
         """Return the proper log constraint"""
-        if self.cet == CET_MULT:
-            if self.rts == RTS_VRS:
-
-                def log_rule(model, i):
-                    return model.frontier[i] == model.alpha[i] + sum(
-                        model.beta[i, j] * self.x[i][j] for j in model.J) - 1
-
-                return log_rule
-            elif self.rts == RTS_CRS:
-
-                def log_rule(model, i):
-                    return model.frontier[i] == sum(
-                        model.beta[i, j] * self.x[i][j] for j in model.J) - 1
-
-                return log_rule
-
-        raise ValueError("Undefined model parameters.")
-
-    def __afriat_rule(self):
-        """Return the proper elementary Afriat approach constraint"""
-        if self.fun == FUN_PROD:
-            __operator = NumericValue.__le__
-        elif self.fun == FUN_COST:
-            __operator = NumericValue.__ge__
-
-        if self.cet == CET_ADDI:
-            if self.rts == RTS_VRS:
-
-                def afriat_rule(model, i):
-                    return __operator(
-                        model.alpha[i] + sum(model.beta[i, j] * self.x[i][j]
-                                             for j in model.J),
-                        model.alpha[self.__model__.I.nextw(i)] +
-                        sum(model.beta[self.__model__.I.nextw(i), j] * self.x[i][j]
-                            for j in model.J))
-
-                return afriat_rule
-            elif self.rts == RTS_CRS:
-                def afriat_rule(model, i):
-                    return __operator(
-                        sum(model.beta[i, j] * self.x[i][j]
-                            for j in model.J),
-                        sum(model.beta[self.__model__.I.nextw(i), j] * self.x[i][j]
-                            for j in model.J))
-
-                return afriat_rule
-        elif self.cet == CET_MULT:
-            if self.rts == RTS_VRS:
+        if self.cet == CET_MULT and self.rts in (RTS_VRS, RTS_CRS):
+            row_index, row_coefs = self.__row_terms(self.rts == RTS_VRS)
+            row_index, row_coefs = row_index.tolist(), row_coefs.tolist()
+            variables = self.__variables
 
-                def afriat_rule(model, i):
-                    return __operator(
-                        model.alpha[i] + sum(model.beta[i, j] * self.x[i][j]
-                                             for j in model.J),
-                        model.alpha[self.__model__.I.nextw(i)] +
-                        sum(model.beta[self.__model__.I.nextw(i), j] * self.x[i][j]
-                            for j in model.J))
+            def log_rule(model, i):
+                return model.frontier[i] == LinearExpression(
+                    constant=-1.0,
+                    linear_coefs=row_coefs[i],
+                    linear_vars=[variables[c] for c in row_index[i]])
 
-                return afriat_rule
-            elif self.rts == RTS_CRS:
-
-                def afriat_rule(model, i):
-                    return __operator(
-                        sum(model.beta[i, j] * self.x[i][j] for j in model.J),
-                        sum(model.beta[self.__model__.I.nextw(i), j] * self.x[i][j] for j in model.J))
-
-                return afriat_rule
+            return log_rule
 
         raise ValueError("Undefined model parameters.")
 
-    def __sweet_rule(self):
-        """Return the proper sweet spot approach constraint"""
-        if self.fun == FUN_PROD:
-            __operator = NumericValue.__le__
-        elif self.fun == FUN_COST:
-            __operator = NumericValue.__ge__
-
-        if self.cet == CET_ADDI:
-            if self.rts == RTS_VRS:
-
-                def sweet_rule(model, i, h):
-                    if self.cutactive[i][h]:
-                        if i == h:
-                            return Constraint.Skip
-                        return __operator(model.alpha[i] + sum(model.beta[i, j] * self.x[i][j]
-                                                               for j in model.J),
-                                          model.alpha[h] + sum(model.beta[h, j] * self.x[i][j]
-                                                               for j in model.J))
-                    return Constraint.Skip
-
-                return sweet_rule
-            elif self.rts == RTS_CRS:
-                def sweet_rule(model, i, h):
-                    if self.cutactive[i][h]:
-                        if i == h:
-                            return Constraint.Skip
-                        return __operator(model.alpha[i] + sum(model.beta[i, j] * self.x[i][j]
-                                                               for j in model.J),
-                                          model.alpha[h] + sum(model.beta[h, j] * self.x[i][j]
-                                                               for j in model.J))
-                    return Constraint.Skip
-
-                return sweet_rule
-        elif self.cet == CET_MULT:
-            if self.rts == RTS_VRS:
-
-                def sweet_rule(model, i, h):
-                    if self.cutactive[i][h]:
-                        if i == h:
-                            return Constraint.Skip
-                        return __operator(model.alpha[i] + sum(model.beta[i, j] * self.x[i][j]
-                                                               for j in model.J),
-                                          model.alpha[h] + sum(model.beta[h, j] * self.x[i][j]
-                                                               for j in model.J))
-                    return Constraint.Skip
-
-                return sweet_rule
-            elif self.rts == RTS_CRS:
-
-                def sweet_rule(model, i, h):
-                    if self.cutactive[i][h]:
-                        if i == h:
-                            return Constraint.Skip
-                        return __operator(sum(model.beta[i, j] * self.x[i][j] for j in model.J),
-                                          sum(model.beta[h, j] * self.x[i][j] for j in model.J))
-                    return Constraint.Skip
-
-                return sweet_rule
+    def __build_sparse_blocks(self):
+        """Return the sparse coefficient matrix and right-hand side of the linear constraints
 
-        raise ValueError("Undefined model parameters.")
+        The columns follow the order of the model variables: alpha, beta, lamda and epsilon.
+        """
+        if self.cet not in (CET_ADDI, CET_MULT) or self.rts not in (RTS_VRS, RTS_CRS):
+            raise ValueError("Undefined model parameters.")
 
-    def __sweet_rule2(self, ):
-        """Return the proper sweet spot (step2) approach constraint"""
-        if self.fun == FUN_PROD:
-            __operator = NumericValue.__le__
-        elif self.fun == FUN_COST:
-            __operator = NumericValue.__ge__
+        z = self.z
+        n, d = self.x.shape
+        lamda_index = n + n * d + np.arange(z.shape[1])
+        epsilon_index = n + n * d + z.shape[1] + np.arange(n)
+        shape = len(self.__variables)
 
+        blocks = {}
         if self.cet == CET_ADDI:
-            if self.rts == RTS_VRS:
-
-                def sweet_rule2(model, i, h):
-                    if self.active[i][h]:
-                        if i == h:
-                            return Constraint.Skip
-                        return __operator(model.alpha[i] + sum(model.beta[i, j] * self.x[i][j]
-                                                               for j in model.J),
-                                          model.alpha[h] + sum(model.beta[h, j] * self.x[i][j]
-                                                               for j in model.J))
-                    return Constraint.Skip
-
-                return sweet_rule2
-            elif self.rts == RTS_CRS:
-                def sweet_rule2(model, i, h):
-                    if self.active[i][h]:
-                        if i == h:
-                            return Constraint.Skip
-                        return __operator(model.alpha[i] + sum(model.beta[i, j] * self.x[i][j]
-                                                               for j in model.J),
-                                          model.alpha[h] + sum(model.beta[h, j] * self.x[i][j]
-                                                               for j in model.J))
-                    return Constraint.Skip
-
-                return sweet_rule2
-        elif self.cet == CET_MULT:
-            if self.rts == RTS_VRS:
-
-                def sweet_rule2(model, i, h):
-                    if self.active[i][h]:
-                        if i == h:
-                            return Constraint.Skip
-                        return __operator(model.alpha[i] + sum(model.beta[i, j] * self.x[i][j]
-                                                               for j in model.J),
-                                          model.alpha[h] + sum(model.beta[h, j] * self.x[i][j]
-                                                               for j in model.J))
-                    return Constraint.Skip
-
-                return sweet_rule2
-            elif self.rts == RTS_CRS:
-
-                def sweet_rule2(model, i, h):
-                    if self.active[i][h]:
-                        if i == h:
-                            return Constraint.Skip
-                        return __operator(sum(model.beta[i, j] * self.x[i][j] for j in model.J),
-                                          sum(model.beta[h, j] * self.x[i][j] for j in model.J))
-                    return Constraint.Skip
-
-                return sweet_rule2
-
-        raise ValueError("Undefined model parameters.")
+            row_index, row_coefs = self.__row_terms(self.rts == RTS_VRS)
+            rows, cols, data = [], [], []
+            for i in range(n):
+                rows.extend([i] * (row_index.shape[1] + len(lamda_index) + 1))
+                cols.extend(row_index[i])
+                cols.extend(lamda_index)
+                cols.append(epsilon_index[i])
+                data.extend(row_coefs[i])
+                data.extend(z[i])
+                data.append(1.0)
+            blocks['regression'] = coo_matrix((data, (rows, cols)), shape=(n, shape)), \
+                np.asarray(self.y, dtype=np.float64)
+
+        # f_i(x_i) - f_next(i)(x_i) for all observations at once
+        rows, cols, data = _pair_coefs(*self.__row_terms(self.rts == RTS_VRS), np.arange(n), self.__next)
+        blocks['afriat'] = coo_matrix((data, (rows, cols)), shape=(n, shape)), np.zeros(n)
+
+        blocks['sweet'] = self.__pair_block(self.__model__.SweetIdx)
+        blocks['sweet2'] = self.__pair_block(self.__model__.SweetIdx2)
+
+        return blocks
+
+    def __pair_block(self, pairs):
+        """Return the sparse sweet spot block with one row per (i, h) pair, in the given order"""
+        # alpha[i] - alpha[h] + sum_j (beta[i, j] - beta[h, j]) * x[i, j];
+        # the additive CRS model keeps alpha in the sweet spot constraints
+        with_alpha = not (self.cet == CET_MULT and self.rts == RTS_CRS)
+        pairs = np.asarray(list(pairs), dtype=int).reshape(-1, 2)
+        rows, cols, data = _pair_coefs(*self.__row_terms(with_alpha), pairs[:, 0], pairs[:, 1])
+        return coo_matrix((data, (rows, cols)), shape=(len(pairs), len(self.__variables))), \
+            np.zeros(len(pairs))
+
+    def __row_terms(self, with_alpha):
+        """Return the cached production expression of each observation, with or without alpha"""
+        if with_alpha:
+            return self.__row_index, self.__row_coefs
+        return self.__row_index[:, 1:], self.__row_coefs[:, 1:]
+
+    def __active_pairs(self, active):
+        """Return the off-diagonal (i, h) pairs flagged in an active matrix"""
+        mask = np.asarray(active) != 0
+        mask[np.diag_indices_from(mask)] = False
+        return [tuple(pair) for pair in np.argwhere(mask).tolist()]
+
+    def __sparse_rows(self, block, operator):
+        """Return one constraint expression per row of a sparse coefficient block"""
+        A, b = block
+        A = A.tocsr()
+        indptr, indices, data = A.indptr.tolist(), A.indices.tolist(), A.data.tolist()
+        variables, b = self.__variables, b.tolist()
+        rows = []
+        for r in range(A.shape[0]):
+            start, end = indptr[r], indptr[r + 1]
+            rows.append(operator(
+                LinearExpression(linear_coefs=data[start:end],
+                                 linear_vars=[variables[c] for c in indices[start:end]]),
+                b[r]))
+        return rows
 
     def get_alpha(self):
         """Return alpha value by array"""
@@ -345,11 +324,10 @@ class CQRZG2:
         """Return beta value by array"""
         if self.optimization_status == 0:
             self.optimize()
-        beta = np.asarray([i + tuple([j]) for i, j in zip(list(self.__model__.beta),
-                                                          list(self.__model__.beta[:, :].value))])
-        beta = pd.DataFrame(beta, columns=['Name', 'Key', 'Value'])
-        beta = beta.pivot(index='Name', columns='Key', values='Value')
-        return beta.to_numpy()
+        n, d = len(self.__model__.I), len(self.__model__.J)
+        beta = np.fromiter((beta.value for row in self.__beta for beta in row),
+                           dtype=np.float64, count=n * d)
+        return beta.reshape(n, d)
 
 
 class CERZG2(CQRZG2):
@@ -377,8 +355,8 @@ class CERZG2(CQRZG2):
 
     def __squared_objective_rule(self):
         def squared_objective_rule(model):
-            return self.tau * sum(model.epsilon_plus[i] ** 2 for i in model.I) \
+            return self.tau * quicksum(model.epsilon_plus[i] ** 2 for i in model.I) \
                 + (1 - self.tau) * \
-                sum(model.epsilon_minus[i] ** 2 for i in model.I)
+                quicksum(model.epsilon_minus[i] ** 2 for i in model.I)
 
         return squared_objective_rule
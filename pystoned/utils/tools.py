@@ -41,9 +41,11 @@ def set_neos_email(address):
     return True
 
 
-def optimize_model(model, email, cet, solver=OPT_DEFAULT):
+def optimize_model(model, email, cet, solver=OPT_DEFAULT, warmstart=False, options=None):
     optimization_status = 0
     if not set_neos_email(email):
+        if is_persistent_solver(solver):
+            return optimize_persistent_model(model, cet, solver, warmstart=warmstart, options=options)[1:]
         if solver is not OPT_DEFAULT:
             assert_solver_available_locally(solver)
         elif cet == CET_ADDI:
@@ -52,8 +54,12 @@ def optimize_model(model, email, cet, solver=OPT_DEFAULT):
             raise ValueError(
                 "Please specify the solver for optimizing multiplicative model locally.")
         solver_instance = SolverFactory(solver)
+        if options is not None:
+            solver_instance.options.update(options)
         print("Estimating the {} locally with {} solver.".format(
             CET_Model_Categories[cet], solver), flush=True)
+        if warmstart and solver_instance.warm_start_capable():
+            return solver_instance.solve(model, tee=True, warmstart=True), 1
         return solver_instance.solve(model, tee=True), 1
     else:
         if solver is OPT_DEFAULT and cet is CET_ADDI:
@@ -70,6 +76,55 @@ def optimize_model(model, email, cet, solver=OPT_DEFAULT):
         raise Exception("Remote solvers are temporarily not available.")
 
 
+def is_persistent_solver(solver):
+    return type(solver) == str and solver.endswith("_persistent")
+
+
+def optimize_persistent_model(model, cet, solver, solver_instance=None, warmstart=False, options=None):
+    """optimize the model locally with a persistent solver
+
+    Args:
+        model (ConcreteModel): the model to optimize.
+        cet (String): CET_ADDI or CET_MULT.
+        solver (String): the persistent solver, e.g. "mosek_persistent".
+        solver_instance (PersistentSolver, optional): the solver instance of a previous solve. Defaults to None.
+        warmstart (bool, optional): start from the current variable values. Defaults to False.
+        options (dict, optional): solver options. Defaults to None.
+
+    Returns:
+        tuple: the solver instance, the solver results and the optimization status.
+    """
+    if solver_instance is None:
+        assert_solver_available_locally(solver)
+        solver_instance = SolverFactory(solver)
+        solver_instance.set_instance(model)
+    if options is not None:
+        solver_instance.options.update(options)
+    print("Estimating the {} locally with {} solver.".format(
+        CET_Model_Categories[cet], solver), flush=True)
+    if warmstart and solver_instance.warm_start_capable():
+        return solver_instance, solver_instance.solve(tee=True, warmstart=True), 1
+    return solver_instance, solver_instance.solve(tee=True), 1
+
+
+def single_thread_options(solver=OPT_DEFAULT):
+    """Return the solver options limiting a local solver to one thread
+
+    Args:
+        solver (String, optional): the solver. The default local solver is MOSEK. Defaults to OPT_DEFAULT.
+
+    Returns:
+        dict: the solver options, empty if the thread option of the solver is unknown.
+    """
+    if solver is OPT_DEFAULT or solver.startswith("mosek"):
+        return {"iparam.num_threads": 1}
+    if solver.startswith("gurobi"):
+        return {"Threads": 1}
+    if solver.startswith("cplex"):
+        return {"threads": 1}
+    return {}
+
+
 def __try_remote_solver(model, cet, solver):
     solver_instance = SolverManagerFactory('neos')
     try: